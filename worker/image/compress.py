@@ -3,13 +3,12 @@ import cloudinary.uploader
 import redis
 from PIL import Image, ImageOps
 import io
-import requests
 import pillow_heif
 from pillow_avif import AvifImagePlugin
 from typing import Tuple, Optional
 from dotenv import load_dotenv
 
-from worker.utils import update_state
+from worker.utils import update_state, HTTP
 from ..worker import celery_app
 
 load_dotenv("../../.env")
@@ -154,7 +153,7 @@ def compress_image_task(
         update_state(task_id, status="processing", progress=5)
         
         # Download image
-        response = requests.get(file_url, timeout=30)
+        response = HTTP.get(file_url, timeout=30)
         response.raise_for_status()
 
         update_state(task_id, progress=15)
@@ -220,7 +219,7 @@ def compress_image_task(
         update_state(task_id, progress=75)
 
         # Check if target size is met, adjust quality if needed
-        compressed_size_kb = len(compressed_buffer.getvalue()) / 1024
+        compressed_size_kb = compressed_buffer.getbuffer().nbytes / 1024
         
         if target_size_kb and compressed_size_kb > target_size_kb and quality > 30:
             # Iteratively reduce quality to meet target size
@@ -234,7 +233,7 @@ def compress_image_task(
                     # Use WebP for better compression at lower qualities
                     compressed_buffer = compressor.compress_with_webp(image, quality)
                 
-                compressed_size_kb = len(compressed_buffer.getvalue()) / 1024
+                compressed_size_kb = compressed_buffer.getbuffer().nbytes / 1024
                 attempts -= 1
 
         update_state(task_id, progress=85)
@@ -242,15 +241,16 @@ def compress_image_task(
         # Upload to Cloudinary
         file_extension = target_format.lower() if target_format != "JPEG" else "jpg"
         
+        compressed_buffer.seek(0)
         compressed_upload = cloudinary.uploader.upload(
-            compressed_buffer.getvalue(),
+            compressed_buffer,
             folder="mediaforge/compressed",
             format=file_extension,
             resource_type="image"
         )
         
         # Calculate compression ratio
-        final_size_kb = len(compressed_buffer.getvalue()) / 1024
+        final_size_kb = compressed_buffer.getbuffer().nbytes / 1024
         compression_ratio = (1 - final_size_kb / original_size_kb) * 100
         
         # Store results
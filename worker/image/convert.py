@@ -3,11 +3,22 @@ import cloudinary.uploader
 import redis
 from PIL import Image
 import io
-import requests
+import shutil
+import tempfile
 from dotenv import load_dotenv
 
-from worker.utils import update_state
+from worker.utils import update_state, HTTP, UPLOAD_CHUNK_SIZE
 from ..worker import celery_app
+try:
+    import mozjpeg_lossless_optimization  # Lossless mozjpeg re-encode of JPEG output
+except ImportError:
+    mozjpeg_lossless_optimization = None
+try:
+    import pyvips  # libvips: streaming, bounded-memory pipeline for huge images
+    # Keep uploads away from libvips' untrusted loaders (magick, poppler, svg, ...)
+    pyvips.block_untrusted_set(True)
+except (ImportError, OSError, AttributeError):
+    pyvips = None
 
 load_dotenv("../../.env")
 
@@ -20,6 +31,47 @@ cloudinary.config(
 
 redis_client = redis.from_url(os.getenv("CELERY_BROKER_URL"), decode_responses=True)
 
+# Refuse decompression bombs (~200MB as RGBA) instead of exhausting worker RAM.
+# Checked in this task only: Image.MAX_IMAGE_PIXELS is process-wide and would
+# also cap the compress and resize tasks.
+MAX_SOURCE_PIXELS = 50_000_000
+
+# ICO output is capped at 256x256, so JPEG sources can be decoded at reduced scale
+ICO_MAX_SIZE = (256, 256)
+
+# Sources larger than this (up to MAX_SOURCE_PIXELS) are converted with libvips instead of Pillow
+VIPS_MIN_PIXELS = 20_000_000
+
+# Only these libvips loaders may read uploads; anything else goes through Pillow
+VIPS_LOADERS = {"jpegload", "pngload", "webpload", "tiffload"}
+
+# Output suffix and libvips save options for formats libvips writes natively
+VIPS_SAVE = {
+    "JPEG": (".jpg", "[Q=95,strip]"),
+    "PNG": (".png", "[compression=1,strip]"),
+    "WEBP": (".webp", "[Q=85,effort=0,strip]"),
+    "TIFF": (".tif", "[compression=deflate]"),
+}
+
+def _open_with_vips(src, normalized_format):
+    """Return a sequential pyvips image for huge sources, or None to use Pillow."""
+    if pyvips is None or normalized_format not in VIPS_SAVE:
+        return None
+    try:
+        image = pyvips.Image.new_from_file(src, access="sequential")
+    except pyvips.Error:
+        return None
+    if image.get("vips-loader") not in VIPS_LOADERS:
+        return None
+    pixels = image.width * image.height
+    if pixels <= VIPS_MIN_PIXELS:
+        return None
+    if pixels > MAX_SOURCE_PIXELS:
+        raise ValueError(
+            f"Image is too large to convert: {pixels} pixels exceeds limit of {MAX_SOURCE_PIXELS}"
+        )
+    return image
+
 @celery_app.task(name='image.convert')
 def convert_image_task(task_id, file_url, target_format="PNG"):
     """Convert image format task"""
@@ -42,49 +94,102 @@ def convert_image_task(task_id, file_url, target_format="PNG"):
         
         update_state(task_id, status="processing", progress=10)
         
-        # Download image
-        response = requests.get(file_url)
-        response.raise_for_status()
-
-        update_state(task_id, progress=30)
-
-        # Open image
-        image = Image.open(io.BytesIO(response.content))
-        
-        # Handle different format conversions
-        if target_format.upper() == "JPEG" and image.mode in ("RGBA", "P"):
-            image = image.convert("RGB")
-        elif target_format.upper() == "PNG" and image.mode != "RGBA":
-            image = image.convert("RGBA")
-        elif target_format.upper() == "PDF" and image.mode != "RGB":
-            image = image.convert("RGB")
-
-        update_state(task_id, progress=60)
-
-        # Convert image
-        converted_buffer = io.BytesIO()
         normalized_format = PILLOW_FORMATS.get(target_format.lower())
         if not normalized_format:
             raise ValueError(f"Unsupported format: {target_format}")
 
-        save_kwargs = {}
-
-        if normalized_format == "JPEG":
-            save_kwargs["quality"] = 95
-            save_kwargs["optimize"] = True
-
-        image.save(converted_buffer, format=normalized_format, **save_kwargs)
-        converted_buffer.seek(0)
-
-        update_state(task_id, progress=80)
-
-        # Upload converted image
-        converted_upload = cloudinary.uploader.upload(
-            converted_buffer.getvalue(),
-            folder="mediaforge/converted",
-            format=target_format.lower(),
-            resource_type="raw" if target_format.lower() == "pdf" else "image"
-        )
+        with tempfile.TemporaryDirectory() as tmp:
+            src = os.path.join(tmp, "src")
+
+            # Stream the download to disk (no full-body copy in RAM)
+            with HTTP.get(file_url, stream=True, timeout=60) as response:
+                response.raise_for_status()
+                response.raw.decode_content = True
+                with open(src, "wb") as f:
+                    shutil.copyfileobj(response.raw, f, length=1024 * 1024)
+
+            update_state(task_id, progress=30)
+
+            vips_image = _open_with_vips(src, normalized_format)
+            if vips_image is not None:
+                # Huge scan: libvips processes it region by region, never whole
+                if normalized_format == "JPEG" and vips_image.hasalpha():
+                    vips_image = vips_image.flatten(background=255)
+
+                update_state(task_id, progress=60)
+
+                suffix, options = VIPS_SAVE[normalized_format]
+                converted_source = os.path.join(tmp, "converted" + suffix)
+                vips_image.write_to_file(converted_source + options)
+            else:
+                # Open image (only the header is read until load())
+                try:
+                    image = Image.open(src)
+                    pixels = image.width * image.height
+                    if pixels > MAX_SOURCE_PIXELS:
+                        raise ValueError(
+                            f"Image is too large to convert: {pixels} pixels exceeds limit of {MAX_SOURCE_PIXELS}"
+                        )
+                    if image.format == "JPEG" and target_format.lower() == "ico":
+                        # libjpeg decodes at 1/2, 1/4 or 1/8 scale during the DCT
+                        image.draft("RGB", ICO_MAX_SIZE)
+                    image.load()
+                except Image.DecompressionBombError as e:
+                    raise ValueError(f"Image is too large to convert: {e}") from e
+
+                # Handle different format conversions
+                if target_format.upper() == "JPEG" and image.mode in ("RGBA", "P"):
+                    image = image.convert("RGB")
+                elif target_format.upper() == "PNG" and image.mode != "RGBA":
+                    image = image.convert("RGBA")
+                elif target_format.upper() == "PDF" and image.mode != "RGB":
+                    image = image.convert("RGB")
+
+                update_state(task_id, progress=60)
+
+                # Convert image
+                converted_buffer = io.BytesIO()
+                save_kwargs = {}
+
+                if normalized_format == "JPEG":
+                    save_kwargs["quality"] = 95
+                    save_kwargs["optimize"] = True
+                    save_kwargs["progressive"] = True
+                elif normalized_format == "PNG":
+                    # Cloudinary re-encodes on delivery, so favour encode speed
+                    save_kwargs["compress_level"] = 1
+                elif normalized_format == "WEBP":
+                    # method=0 is the fastest WebP encoder mode
+                    save_kwargs["method"] = 0
+                    save_kwargs["quality"] = 85
+
+                image.save(converted_buffer, format=normalized_format, **save_kwargs)
+
+                if normalized_format == "JPEG" and mozjpeg_lossless_optimization:
+                    converted_buffer = io.BytesIO(
+                        mozjpeg_lossless_optimization.optimize(converted_buffer.getvalue())
+                    )
+
+                converted_buffer.seek(0)
+                converted_source = converted_buffer
+
+            update_state(task_id, progress=80)
+
+            # Upload converted image straight from the file/buffer (avoids a getvalue() copy)
+            upload_options = dict(
+                folder="mediaforge/converted",
+                format=target_format.lower(),
+                resource_type="raw" if target_format.lower() == "pdf" else "image"
+            )
+            if vips_image is not None:
+                # Huge outputs go up in chunks to stay under single-request size caps
+                converted_upload = cloudinary.uploader.upload_large(
+                    converted_source,
+                    chunk_size=UPLOAD_CHUNK_SIZE,
+                    **upload_options
+                )
+            else:
+                converted_upload = cloudinary.uploader.upload(converted_source, **upload_options)
         
         result_data = {
             "status": "completed",
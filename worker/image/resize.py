@@ -3,10 +3,9 @@ import cloudinary.uploader
 import redis
 from PIL import Image
 import io
-import requests
 from dotenv import load_dotenv
 
-from worker.utils import update_state
+from worker.utils import update_state, HTTP
 from ..worker import celery_app
 
 load_dotenv("../../.env")
@@ -29,7 +28,7 @@ def resize_image_task(task_id, file_url, width, height, maintain_aspect_ratio=Tr
         update_state(task_id, status="processing", progress=10)
         
         # Download image
-        response = requests.get(file_url)
+        response = HTTP.get(file_url)
         response.raise_for_status()
 
         update_state(task_id, progress=30)
@@ -38,6 +37,10 @@ def resize_image_task(task_id, file_url, width, height, maintain_aspect_ratio=Tr
         image = Image.open(io.BytesIO(response.content))
         original_format = image.format
 
+        # Let libjpeg decode close to the target size (thumbnail() does this itself)
+        if original_format == "JPEG" and not maintain_aspect_ratio:
+            image.draft("RGB", (width, height))
+
         update_state(task_id, progress=50)
         
         # Resize image
@@ -66,7 +69,7 @@ def resize_image_task(task_id, file_url, width, height, maintain_aspect_ratio=Tr
 
         # Upload resized image
         resized_upload = cloudinary.uploader.upload(
-            resized_buffer.getvalue(),
+            resized_buffer,
             folder="mediaforge/resized",
             format=save_format.lower()
         )
@@ -1,30 +1,30 @@
 # worker/pdf_compress.py
 
 import os
-import json
+import math
 import tempfile
 import subprocess
-import requests
 import shutil
 import platform
+import threading
 
 import pikepdf
-import redis
 import cloudinary
 import cloudinary.uploader as cu
+import cloudinary.exceptions
+from celery.exceptions import Retry
 
 from dotenv import load_dotenv
+try:
+    import ocrmypdf  # In-process OCR; imported once per worker, not per job
+except ImportError:
+    ocrmypdf = None
+from worker.utils import ProgressBatcher, HTTP, UPLOAD_CHUNK_SIZE
 from ..worker import celery_app
 
 # ---------- ENV ----------
 load_dotenv("../../.env")
 
-# ---------- REDIS ----------
-REDIS = redis.from_url(
-    os.environ["CELERY_BROKER_URL"],
-    decode_responses=True
-)
-
 # ---------- CLOUDINARY ----------
 cloudinary.config(
     cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
@@ -37,38 +37,56 @@ LEVELS = {
     "low": {
         "dpi": 300,
         "jpeg_q": 85,
-        "jbig2": "--jbig2-lossless",
+        "jbig2_lossy": False,
         "gs": "/printer",
+        "color_res": 300,
+        "gray_res": 300,
+        "mono_res": 600,
+        "downsample_type": "/Bicubic",
     },
     "medium": {
         "dpi": 150,
         "jpeg_q": 65,
-        "jbig2": "--jbig2-lossless",
+        "jbig2_lossy": False,
         "gs": "/ebook",
+        "color_res": 150,
+        "gray_res": 150,
+        "mono_res": 300,
+        "downsample_type": "/Bicubic",
     },
     "high": {
         "dpi": 96,
         "jpeg_q": 45,
-        "jbig2": "--jbig2-lossy",
+        "jbig2_lossy": True,
         "gs": "/screen",
+        "color_res": 96,
+        "gray_res": 96,
+        "mono_res": 200,
+        "downsample_type": "/Bicubic",
     },
 }
 
+# ---------- PIKEPDF ----------
+# Flate level used by pikepdf (and recompress_flate) for every save
+pikepdf.settings.set_flate_compression_level(9)
+
+# ---------- FAST PATH ----------
+# Text-only PDFs (no images on the sampled pages) under this size that
+# pikepdf kept within 10% of the original skip OCR and Ghostscript entirely.
+FAST_PATH_MAX_BYTES = 2_000_000
+FAST_PATH_MIN_RATIO = 0.9
+
 # ---------- HELPERS ----------
 
-def _update(task_id, **fields):
-    """Update Redis task state."""
-    REDIS.hset(task_id, mapping={k: str(v) for k, v in fields.items()})
-    REDIS.publish(f"progress:{task_id}", json.dumps(fields))
+# Constant for the worker's lifetime, so resolve it once.
+IS_WINDOWS = platform.system() == "Windows"
 
 def _safe_path(path):
     """
     Ghostscript hates Windows backslashes in paths (e.g., C:\Temp).
     We must convert them to forward slashes.
     """
-    if platform.system() == "Windows":
-        return path.replace("\\", "/")
-    return path
+    return path.replace("\\", "/") if IS_WINDOWS else path
 
 def _validate_file(path, step_name):
     """Raises error if file doesn't exist or is empty."""
@@ -79,6 +97,17 @@ def _validate_file(path, step_name):
         raise RuntimeError(f"[{step_name}] Generated file is 0 bytes: {path}")
     return size
 
+def _has_image_xobjects(res) -> bool:
+    """Probe XObject subtypes for images (no PdfImage views)."""
+    xobjects = res.get("/XObject", {})
+    return any(xobj.get("/Subtype") == "/Image" for xobj in xobjects.values())
+
+def _has_images(pdf: pikepdf.Pdf, sample=3) -> bool:
+    """
+    Checks if any sampled page has images.
+    """
+    return any(_has_image_xobjects(page.resources) for page in pdf.pages[:sample])
+
 def _is_scanned(pdf: pikepdf.Pdf, sample=3) -> bool:
     """
     Checks if pages have images but NO fonts (text).
@@ -86,20 +115,23 @@ def _is_scanned(pdf: pikepdf.Pdf, sample=3) -> bool:
     scanned_cnt = 0
     pages = pdf.pages[:sample]
     if not pages: return False
+    needed = math.ceil(0.8 * len(pages))
     
     for page in pages:
-        # Check if page has images
-        has_images = len(page.images) > 0
+        res = page.resources
         # Check if page has fonts (selectable text)
-        has_fonts = "/Font" in page.resources
-        
-        if has_images and not has_fonts:
+        if "/Font" in res:
+            continue
+        # Check if page has images
+        if _has_image_xobjects(res):
             scanned_cnt += 1
+            if scanned_cnt >= needed:
+                return True
             
-    return (scanned_cnt / len(pages)) >= 0.8
+    return False
 
 def _find_executable(unix_name, windows_alt=None):
-    if os.name == "nt" and windows_alt:
+    if IS_WINDOWS and windows_alt:
         path = shutil.which(windows_alt)
         if path: return path
     path = shutil.which(unix_name)
@@ -109,28 +141,22 @@ def _find_executable(unix_name, windows_alt=None):
 
 # ---------- RESOLVE BINARIES ----------
 GS_EXEC = _find_executable("gs", windows_alt="gswin64c")
-OCR_EXEC = shutil.which("ocrmypdf")
+GS_EXEC_SAFE = _safe_path(GS_EXEC)
+
+# ocrmypdf.ocr() isn't thread-safe and tesseract already uses every core,
+# so tasks sharing a process (e.g. Celery's threads pool) take turns.
+_OCR_LOCK = threading.Lock()
 
 # ---------- CELERY TASK ----------
 @celery_app.task(name="pdf.compress", bind=True, max_retries=2)
 def compress_pdf_task(self, task_id: str, file_url: str, compression_level="medium"):
+    state = ProgressBatcher(task_id)
     try:
         if compression_level not in LEVELS:
             compression_level = "medium"
         cfg = LEVELS[compression_level]
 
-        _update(task_id, status="processing", progress=5)
-
-        # 1. DOWNLOAD
-        resp = requests.get(file_url, timeout=60)
-        resp.raise_for_status()
-        pdf_bytes = resp.content
-        orig_size = len(pdf_bytes)
-        
-        if orig_size == 0:
-            raise ValueError("Source file download is 0 bytes.")
-
-        _update(task_id, progress=20)
+        state.update(status="processing", progress=5)
 
         with tempfile.TemporaryDirectory() as tmp:
             # Setup paths
@@ -139,88 +165,140 @@ def compress_pdf_task(self, task_id: str, file_url: str, compression_level="medi
             p2 = os.path.join(tmp, "p2.pdf")
             out = os.path.join(tmp, "out.pdf")
 
-            # Write Source
-            with open(src, "wb") as f:
-                f.write(pdf_bytes)
+            # 1. DOWNLOAD (streamed straight to disk, never held in memory)
+            with HTTP.get(file_url, stream=True, timeout=60) as resp:
+                resp.raise_for_status()
+                resp.raw.decode_content = True
+                with open(src, "wb") as f:
+                    shutil.copyfileobj(resp.raw, f, length=1024 * 1024)
+
+            orig_size = os.path.getsize(src)
+            if orig_size == 0:
+                raise ValueError("Source file download is 0 bytes.")
+
+            state.update(progress=20)
+
             _validate_file(src, "Download")
 
-            _update(task_id, progress=30)
+            state.update(progress=30)
+            state.flush()
 
             # 2. PRE-PROCESS (Pikepdf)
             # IMPORTANT: Do NOT use linearize=True here. It breaks GS processing often.
             with pikepdf.open(src) as pdf:
                 scanned = _is_scanned(pdf)
-                pdf.save(p1, compress_streams=True)
-            
-            _validate_file(p1, "Pikepdf")
-
-            # 3. OCR (Conditional)
-            p2_in = p1
-            if scanned and OCR_EXEC:
-                _update(task_id, progress=45)
-                ocr_cmd = [
-                    OCR_EXEC,
-                    "--skip-text",
-                    "--optimize", "2",
-                    "--jpeg-quality", str(cfg["jpeg_q"]),
-                    "--image-dpi", str(cfg["dpi"]),
-                    cfg["jbig2"],
-                    "--output-type", "pdf",
+                has_images = scanned or _has_images(pdf)
+                # Object streams pack small dicts into one compressed stream
+                pdf.save(
                     p1,
-                    p2,
-                ]
-                subprocess.run(ocr_cmd, check=True)
-                _validate_file(p2, "OCR")
-                p2_in = p2
-
-            # 4. GHOSTSCRIPT COMPRESSION
-            _update(task_id, progress=70)
-
-            # Sanitize paths for Ghostscript (Crucial for Windows)
-            gs_input = _safe_path(p2_in)
-            gs_output = _safe_path(out)
-            gs_exe = _safe_path(GS_EXEC)
-
-            gs_cmd = [
-                gs_exe,
-                "-sDEVICE=pdfwrite",
-                "-dCompatibilityLevel=1.4",
-                f"-dPDFSETTINGS={cfg['gs']}",
-                "-dNOPAUSE", 
-                "-dQUIET", 
-                "-dBATCH",
-                "-dSAFER",
-                f"-sOutputFile={gs_output}",
-                gs_input,
-            ]
+                    compress_streams=True,
+                    recompress_flate=True,
+                    object_stream_mode=pikepdf.ObjectStreamMode.generate,
+                    linearize=False,
+                )
             
-            # Run GS
-            subprocess.run(gs_cmd, check=True)
+            p1_size = _validate_file(p1, "Pikepdf")
+
+            # Fast path: small text PDFs that pikepdf barely shrank gain nothing from GS
+            fast_path = (
+                not has_images
+                and p1_size >= FAST_PATH_MIN_RATIO * orig_size
+                and p1_size < FAST_PATH_MAX_BYTES
+            )
+
+            if fast_path:
+                shutil.copy(p1 if p1_size <= orig_size else src, out)
+                state.update(progress=70, fast_path="true")
+            else:
+                # 3. OCR (Conditional)
+                p2_in = p1
+                if scanned and ocrmypdf:
+                    state.update(progress=45)
+                    state.flush()
+                    try:
+                        with _OCR_LOCK:
+                            ocrmypdf.ocr(
+                                p1,
+                                p2,
+                                skip_text=True,
+                                optimize=2,
+                                jpeg_quality=cfg["jpeg_q"],
+                                image_dpi=cfg["dpi"],
+                                jbig2_lossy=cfg["jbig2_lossy"],
+                                output_type="pdf",
+                                progress_bar=False,
+                                use_threads=True,  # Celery prefork children can't spawn processes
+                            )
+                    except ocrmypdf.exceptions.ExitCodeException as e:
+                        raise subprocess.CalledProcessError(int(e.exit_code), "ocrmypdf") from e
+                    _validate_file(p2, "OCR")
+                    p2_in = p2
+
+                # 4. GHOSTSCRIPT COMPRESSION
+                state.update(progress=70)
+                state.flush()
+
+                # Sanitize paths for Ghostscript (Crucial for Windows)
+                gs_input = _safe_path(p2_in)
+                gs_output = _safe_path(out)
+
+                gs_cmd = [
+                    GS_EXEC_SAFE,
+                    "-sDEVICE=pdfwrite",
+                    "-dCompatibilityLevel=1.4",
+                    # PDFSETTINGS only provides the defaults; the explicit image knobs after it win.
+                    f"-dPDFSETTINGS={cfg['gs']}",
+                    "-dDownsampleColorImages=true",
+                    "-dDownsampleGrayImages=true",
+                    "-dDownsampleMonoImages=true",
+                    f"-dColorImageDownsampleType={cfg['downsample_type']}",
+                    f"-dGrayImageDownsampleType={cfg['downsample_type']}",
+                    f"-dColorImageResolution={cfg['color_res']}",
+                    f"-dGrayImageResolution={cfg['gray_res']}",
+                    f"-dMonoImageResolution={cfg['mono_res']}",
+                    "-dDetectDuplicateImages=true",
+                    "-dCompressFonts=true",
+                    "-dNOPAUSE", 
+                    "-dQUIET", 
+                    "-dBATCH",
+                    "-dSAFER",
+                    f"-sOutputFile={gs_output}",
+                    gs_input,
+                ]
             
+                # Run GS
+                subprocess.run(gs_cmd, check=True)
+
             # Validate Final Output
             final_size = _validate_file(out, "Ghostscript")
             
             # Calculate Savings
             ratio = 100 * (1 - final_size / orig_size)
-            _update(task_id, progress=85)
+            state.update(progress=85)
+            state.flush()
 
             # 5. UPLOAD
             # Use resource_type="auto" to let Cloudinary detect it as a PDF correctly.
             # "raw" is risky if headers aren't perfect.
-            upload_res = cu.upload(
-                out,
-                resource_type="auto",  
-                folder="mediaforge/pdf_compressed",
-                use_filename=True,
-                unique_filename=True,
-                flags="attachment"  # Optional: forces browser to download rather than view
-            )
+            # upload_large sends the file in chunks, so big PDFs survive proxy caps.
+            try:
+                upload_res = cu.upload_large(
+                    out,
+                    resource_type="auto",
+                    chunk_size=UPLOAD_CHUNK_SIZE,
+                    folder="mediaforge/pdf_compressed",
+                    use_filename=True,
+                    unique_filename=True,
+                    flags="attachment"  # Optional: forces browser to download rather than view
+                )
+            except (cloudinary.exceptions.GeneralError, cloudinary.exceptions.RateLimited) as e:
+                # Connection errors, 5xx and rate limits only; bad requests and auth errors fail the task
+                raise self.retry(exc=e, countdown=5)
             
             cloud_url = upload_res["secure_url"]
 
         # DONE
-        _update(
-            task_id,
+        state.update(
             status="completed",
             progress=100,
             result_url=cloud_url,
@@ -231,10 +309,16 @@ def compress_pdf_task(self, task_id: str, file_url: str, compression_level="medi
 
         return cloud_url
 
+    except Retry:
+        raise
+
     except subprocess.CalledProcessError as e:
-        _update(task_id, status="failed", error=f"Process Error: {e}")
+        state.update(status="failed", error=f"Process Error: {e}")
         raise
 
     except Exception as e:
-        _update(task_id, status="failed", error=f"Worker Error: {str(e)}")
-        raise
\ No newline at end of file
+        state.update(status="failed", error=f"Worker Error: {str(e)}")
+        raise
+
+    finally:
+        state.flush()
\ No newline at end of file
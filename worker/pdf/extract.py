@@ -1,11 +1,14 @@
 import os
 import io
-import requests
+import shutil
+import tempfile
 import fitz  # PyMuPDF
 import cloudinary.uploader
+import cloudinary.exceptions
+from celery.exceptions import Retry
 from dotenv import load_dotenv
 
-from worker.utils import update_state
+from worker.utils import update_state, HTTP, UPLOAD_CHUNK_SIZE
 from ..worker import celery_app
 
 load_dotenv("../../.env")
@@ -17,8 +20,9 @@ cloudinary.config(
     api_secret=os.getenv("CLOUDINARY_API_SECRET"),
 )
 
-@celery_app.task(name="pdf.extract")
+@celery_app.task(name="pdf.extract", bind=True, max_retries=2)
 def extract_pdf_task(
+    self,
     task_id: str,
     file_url: str,
     start_page: int,
@@ -32,60 +36,67 @@ def extract_pdf_task(
     try:
         update_state(task_id, status="processing", progress=5)
 
-        # Download original PDF
-        response = requests.get(file_url, timeout=60)
-        response.raise_for_status()
+        with tempfile.TemporaryDirectory() as tmp:
+            src = os.path.join(tmp, "src.pdf")
 
-        update_state(task_id, progress=15)
+            # Download original PDF (streamed to disk, not held in memory)
+            with HTTP.get(file_url, stream=True, timeout=60) as response:
+                response.raise_for_status()
+                response.raw.decode_content = True
+                with open(src, "wb") as f:
+                    shutil.copyfileobj(response.raw, f, length=1024 * 1024)
 
-        original_pdf = fitz.open(stream=response.content, filetype="pdf")
-        total_pages = original_pdf.page_count
+            update_state(task_id, progress=15)
 
-        # Validate page range
-        if start_page < 1 or end_page > total_pages or start_page > end_page:
-            raise ValueError("Invalid page range")
+            original_pdf = fitz.open(src)
+            total_pages = original_pdf.page_count
 
-        update_state(task_id, progress=30)
+            # Validate page range
+            if start_page < 1 or end_page > total_pages or start_page > end_page:
+                raise ValueError("Invalid page range")
 
-        # Create new PDF
-        extracted_pdf = fitz.open()
+            update_state(task_id, progress=30)
 
-        # Convert to 0-based index
-        extracted_pdf.insert_pdf(
-            original_pdf,
-            from_page=start_page - 1,
-            to_page=end_page - 1
-        )
+            # Keep only the requested pages in place (0-based index);
+            # no objects are copied into a second document.
+            original_pdf.select(range(start_page - 1, end_page))
 
-        update_state(task_id, progress=60)
+            update_state(task_id, progress=60)
 
-        # Save extracted PDF SAFELY
-        extracted_buffer = io.BytesIO()
-        extracted_pdf.save(
-            extracted_buffer,
-            garbage=4,
-            deflate=True,
-            clean=True
-        )
+            # Save extracted PDF SAFELY
+            extracted_buffer = io.BytesIO()
+            original_pdf.save(
+                extracted_buffer,
+                garbage=3,
+                deflate=True,
+                clean=True,
+                use_objstms=1
+            )
 
-        extracted_buffer.seek(0)
-        extracted_pdf.close()
-        original_pdf.close()
+            extracted_buffer.seek(0)
+            original_pdf.close()
 
         # 🔍 Safety check
-        extracted_size = len(extracted_buffer.getvalue())
+        extracted_size = extracted_buffer.getbuffer().nbytes
         if extracted_size == 0:
             raise RuntimeError("Extracted PDF is empty")
 
         update_state(task_id, progress=80)
 
         # Upload to Cloudinary (IMPORTANT FIX)
-        extracted_upload = cloudinary.uploader.upload(
-            extracted_buffer.getvalue(),
-            folder="mediaforge/pdf_extracted",
-            resource_type="raw",
-            public_id=f"{task_id}.pdf"
-        )
+        # upload_large streams the buffer in chunks instead of one big request
+        try:
+            extracted_upload = cloudinary.uploader.upload_large(
+                extracted_buffer,
+                filename=f"{task_id}.pdf",
+                chunk_size=UPLOAD_CHUNK_SIZE,
+                folder="mediaforge/pdf_extracted",
+                resource_type="raw",
+                public_id=f"{task_id}.pdf"
+            )
+        except (cloudinary.exceptions.GeneralError, cloudinary.exceptions.RateLimited) as e:
+            # Only transient upload failures are worth re-running the extraction for
+            raise self.retry(exc=e, countdown=5)
 
         update_state(
             task_id,
@@ -96,6 +107,9 @@ def extract_pdf_task(
 
         return extracted_upload["secure_url"]
 
+    except Retry:
+        raise
+
     except Exception as e:
         update_state(task_id, status="failed", error=str(e))
         raise
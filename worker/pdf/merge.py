@@ -2,10 +2,11 @@ import os
 import cloudinary.uploader
 import redis
 import io
-import requests
+import shutil
+import tempfile
 from dotenv import load_dotenv
 
-from worker.utils import update_state
+from worker.utils import update_state, HTTP
 from ..worker import celery_app
 try:
     import fitz  # PyMuPDF
@@ -40,22 +41,29 @@ def merge_pdf_task(task_id, pdf_urls):
         total_pdfs = len(pdf_urls)
         progress_per_pdf = 70 / total_pdfs
         
-        for i, pdf_url in enumerate(pdf_urls):
-            # Download PDF
-            response = requests.get(pdf_url)
-            response.raise_for_status()
-            
-            # Open PDF
-            pdf_document = fitz.open(stream=response.content, filetype="pdf")
-            
-            # Insert all pages from this PDF
-            merged_pdf.insert_pdf(pdf_document)
-            
-            pdf_document.close()
-            
-            # Update progress
-            current_progress = 10 + (i + 1) * progress_per_pdf
-            update_state(task_id, progress=int(current_progress))
+        with tempfile.TemporaryDirectory() as tmp:
+            for i, pdf_url in enumerate(pdf_urls):
+                src = os.path.join(tmp, f"src_{i}.pdf")
+
+                # Download PDF (streamed to disk, not held in memory)
+                with HTTP.get(pdf_url, stream=True, timeout=60) as response:
+                    response.raise_for_status()
+                    response.raw.decode_content = True
+                    with open(src, "wb") as f:
+                        shutil.copyfileobj(response.raw, f, length=1024 * 1024)
+                
+                # Open PDF from the file so MuPDF reads it on demand
+                pdf_document = fitz.open(src)
+                
+                # Insert all pages from this PDF
+                merged_pdf.insert_pdf(pdf_document)
+                
+                pdf_document.close()
+                os.remove(src)
+                
+                # Update progress
+                current_progress = 10 + (i + 1) * progress_per_pdf
+                update_state(task_id, progress=int(current_progress))
 
         update_state(task_id, progress=85)
 
@@ -70,7 +78,7 @@ def merge_pdf_task(task_id, pdf_urls):
 
         # Upload merged PDF
         merged_upload = cloudinary.uploader.upload(
-            merged_buffer.getvalue(),
+            merged_buffer,
             folder="mediaforge/pdf_merged",
             resource_type="raw",
             format="pdf"
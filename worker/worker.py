@@ -14,7 +14,9 @@ celery_app.conf.update(
     result_serializer='json',
     timezone='UTC',
     enable_utc=True,
-    task_track_started=True,
+    # Progress and results live in the Redis task hash + progress:{task_id}
+    # pub/sub written by the tasks; nothing reads Celery result state.
+    task_ignore_result=True,
     worker_send_task_events=True,
     task_send_sent_event=True,
 )